@@ -1,6 +1,5 @@
 # noqa: INP001
 
-from itertools import product
 from pathlib import Path
 
 import nox
@@ -11,7 +10,7 @@ py_envs = (py_default, "3.11", "3.6")
 nox.options.error_on_external_run = True
 nox.options.sessions = (
     "clean",
-    *map("-".join, product(("test",), py_envs)),
+    *("test-" + py_env for py_env in py_envs),
     "report",
 )
 
@@ -9,14 +9,27 @@
 Utilities to build command-line action-based programs.
 """
 
-import optparse
+import argparse
+import errno
 import os
+import re
 import sys
 import types
 from enum import Enum
-from inspect import isclass
+from inspect import getdoc, isclass
 from keyword import iskeyword
 
+_DOC_HELP_RE = re.compile(r":doc:`(.+?)-help`")
+_SECTION_HEADING_RE = re.compile(r":(.+):\Z")
+_RST_MARKUP_RE = re.compile(r"^:|::$|:doc:", re.MULTILINE)
+
+
+def _map_doc_refs(line):
+    # Map :doc:`xxx-help` to ``help xxx``
+    if ":doc:" in line:
+        line = _DOC_HELP_RE.sub(r"``help \1``", line)
+    return line
+
 
 def rst_to_plain_text(text):
     """Minimal converter of reStructuredText to plain text.
@@ -25,8 +38,14 @@ def rst_to_plain_text(text):
 
     :param text: Text to be converted.
     :rtype: str
+
+    >>> from cmdcmd.cmd import rst_to_plain_text
+    >>> rst_to_plain_text("See :doc:`foo-help` and :doc:`bar-help`.").strip()
+    'See ``help foo`` and ``help bar``.'
     """
-    import re
+    # Most text does not contain any markup that needs to be converted.
+    if _RST_MARKUP_RE.search(text) is None:
+        return text if text.endswith("\n") else text + "\n"
 
     lines = text.splitlines()
     result = []
@@ -35,9 +54,7 @@ def rst_to_plain_text(text):
             line = line[1:]
         elif line.endswith("::"):
             line = line[:-1]
-        # Map :doc:`xxx-help` to ``help xxx``
-        line = re.sub(":doc:`(.+)-help`", r"``help \1``", line)
-        result.append(line)
+        result.append(_map_doc_refs(line))
     return "\n".join(result) + "\n"
 
 
@@ -45,16 +62,24 @@ class CommandError(RuntimeError):
     """An error occured running a command."""
 
 
+# Standard and global options, registered with _standard_option() and
+# _global_option(). Exposed read-only as Option.STD_OPTIONS and
+# Option.OPTIONS.
+_std_options = {}
+_options = {}
+
+
 class Option:
     """Describes a command line option.
 
-    :ivar _short_name: If the option has a single-letter alias, this is
+    :ivar short_name: If the option has a single-letter alias, this is
         defined. Otherwise this is None.
+    :ivar negation_name: Negated name of the option.
     """
 
-    STD_OPTIONS = {}
+    STD_OPTIONS = types.MappingProxyType(_std_options)
 
-    OPTIONS = {}
+    OPTIONS = types.MappingProxyType(_options)
 
     def __init__(
         self,
@@ -90,11 +115,15 @@ class Option:
             short_name="v" to enable parsing of -v.
 
         :param param_name: name of the parameter which will be passed to
-            the command's run() method.
+            the command's run() method. Dashes are replaced by underscores,
+            and if it is a Python keyword, it gets prefixed with an
+            underscore, e.g. ``_continue``.
 
         :param custom_callback: a callback routine to be called after normal
             processing. The signature of the callback routine is
-            (option, name, new_value, parser).
+            (action, name, new_value, parser), where action is the
+            ``argparse.Action`` which handled the option. The values parsed
+            so far are available as ``parser.values``.
         :param hidden: If True, the option should be hidden in help and
             documentation.
 
@@ -114,7 +143,7 @@ class Option:
         self.name = name
         self.help = help
         self.type = type
-        self._short_name = short_name
+        self.short_name = short_name or None
         if type is None:
             if argname:
                 raise ValueError("argname not valid for booleans")
@@ -124,100 +153,118 @@ class Option:
             argname = argname.upper()
         self.argname = argname
         if param_name is None:
-            self._param_name = self.name.replace("-", "_")
-        else:
-            self._param_name = param_name
+            param_name = self.name
+        param_name = param_name.replace("-", "_")
+        if iskeyword(param_name):
+            param_name = "_" + param_name
+        self._param_name = param_name
         self.custom_callback = custom_callback
         self.hidden = hidden
-
-    def get_short_name(self):
-        """Return the short name of the option."""
-        if self._short_name:
-            return self._short_name
-
-    def set_short_name(self, short_name):
-        """Set the short name of the option."""
-        self._short_name = short_name
-
-    short_name = property(
-        get_short_name, set_short_name, doc="Short name of the option"
-    )
-
-    def get_negation_name(self):
-        """Return the negated name of the option."""
-        if self.name.startswith("no-"):
-            return self.name[3:]
+        if name.startswith("no-"):
+            self.negation_name = name[3:]
         else:
-            return "no-" + self.name
+            self.negation_name = "no-" + name
 
-    negation_name = property(get_negation_name, doc="Negated name of the option")
-
-    def add_option(self, parser, short_name):
-        """Add this option to an optparse parser."""
+    def add_option(self, parser):
+        """Add this option to an argparse parser."""
         option_strings = ["--" + self.name]
-        if short_name is not None:
-            option_strings.append("-" + short_name)
+        if self.short_name is not None:
+            option_strings.insert(0, "-" + self.short_name)
         if self.hidden:
-            _help = optparse.SUPPRESS_HELP
+            _help = argparse.SUPPRESS
         else:
-            _help = self.help
+            _help = (self.help or "").replace("%", "%%")
+        # Options which are not given do not get a value at all.
+        kwarg = {"dest": self._param_name, "default": argparse.SUPPRESS}
+        if self.custom_callback is not None:
+            kwarg.update(action=_CallbackAction, option=self)
         optargfn = self.type
         if optargfn is None:
-            parser.add_option(
-                action="callback",
-                callback=self._optparse_bool_callback,
-                callback_args=(True,),
-                help=_help,
-                *option_strings
-            )
-            negation_strings = ["--" + self.get_negation_name()]
-            parser.add_option(
-                action="callback",
-                callback=self._optparse_bool_callback,
-                callback_args=(False,),
-                help=optparse.SUPPRESS_HELP,
-                *negation_strings
-            )
-        elif issubclass(optargfn, Enum):
-            values = (m.value for m in optargfn.__members__.values())
-            parser.add_option(
-                action="callback",
-                callback=self._optparse_callback,
-                type="choice",
-                choices=tuple(values),
-                metavar=self.argname,
-                help=_help,
-                default=OptionParser.DEFAULT_VALUE,
-                *option_strings
+            if self.custom_callback is None:
+                kwarg.update(action="store_const")
+            else:
+                kwarg.update(nargs=0)
+            parser.add_argument(*option_strings, const=True, help=_help, **kwarg)
+            parser.add_argument(
+                "--" + self.negation_name, const=False, help=argparse.SUPPRESS, **kwarg
             )
         else:
-            parser.add_option(
-                action="callback",
-                callback=self._optparse_callback,
-                type="string",
+            if issubclass(optargfn, Enum):
+                optargfn = _enum_type(optargfn)
+            parser.add_argument(
+                *option_strings,
+                type=optargfn,
                 metavar=self.argname,
                 help=_help,
-                default=OptionParser.DEFAULT_VALUE,
-                *option_strings
+                **kwarg
             )
 
-    def _optparse_bool_callback(self, option, opt_str, value, parser, bool_v):
-        setattr(parser.values, self._param_name, bool_v)
-        if self.custom_callback is not None:
-            self.custom_callback(option, self._param_name, bool_v, parser)
-
-    def _optparse_callback(self, option, opt, value, parser):
-        v = self.type(value)
-        setattr(parser.values, self._param_name, v)
-        if self.custom_callback is not None:
-            self.custom_callback(option, self.name, v, parser)
-
     def iter_switches(self):
         """Iterate through the list of switches provided by the option
 
         :return: an iterator of (name, short_name, argname, help)
         """
-        yield self.name, self.short_name(), self.argname, self.help
+        yield self.name, self.short_name, self.argname, self.help
+
+
+def _enum_type(enum):
+    """Make a function to convert option arguments to values of an ``Enum``.
+
+    :param enum: An ``Enum`` subclass, with strings as values.
+    """
+    choices = ", ".join(repr(m.value) for m in enum.__members__.values())
+
+    def convert(value):
+        try:
+            return enum(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                "invalid choice: {0!r} (choose from {1!s})".format(value, choices)
+            ) from None
+
+    return convert
+
+
+class _CallbackAction(argparse.Action):
+    """Stores the value of an option, then runs its custom callback."""
+
+    def __init__(self, option_strings, dest, option, **kwarg):
+        super().__init__(option_strings, dest, **kwarg)
+        self.option = option
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        # Boolean options pass the parameter name, other options their name.
+        if self.nargs == 0:
+            values = self.const
+            name = self.dest
+        else:
+            name = self.option.name
+        setattr(namespace, self.dest, values)
+        self.option.custom_callback(self, name, values, parser)
+
+
+class _ListAction(argparse.Action):
+    """Appends values to a list, or empties it when the value is "-"."""
+
+    def __init__(self, option_strings, dest, option, **kwarg):
+        super().__init__(option_strings, dest, **kwarg)
+        self.option = option
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        items = getattr(namespace, self.dest)
+        if values == "-":
+            del items[:]
+        else:
+            if self.option.type is not None:
+                try:
+                    values = self.option.type(values)
+                except (TypeError, ValueError):
+                    raise argparse.ArgumentError(
+                        self, "invalid value: {0!r}".format(values)
+                    ) from None
+            items.append(values)
+        if self.option.custom_callback is not None:
+            self.option.custom_callback(self, self.dest, items, parser)
 
 
 class ListOption(Option):
@@ -231,60 +278,141 @@ class ListOption(Option):
     sets the value of the 'foo' option to ['c'].
     """
 
-    def add_option(self, parser, short_name):
-        """Add this option to an Optparse parser."""
+    def add_option(self, parser):
+        """Add this option to an argparse parser."""
         option_strings = ["--" + self.name]
-        if short_name is not None:
-            option_strings.append("-" + short_name)
-        parser.add_option(
-            action="callback",
-            callback=self._optparse_callback,
-            type="string",
+        if self.short_name is not None:
+            option_strings.insert(0, "-" + self.short_name)
+        parser.add_argument(
+            *option_strings,
+            action=_ListAction,
+            option=self,
             metavar=self.argname,
-            help=self.help,
-            default=[],
-            *option_strings
+            help=(self.help or "").replace("%", "%%"),
+            dest=self._param_name,
+            default=[]
         )
 
-    def _optparse_callback(self, option, opt, value, parser):
-        values = getattr(parser.values, self._param_name)
-        if value == "-":
-            del values[:]
-        else:
-            values.append(self.type(value))
-        if self.custom_callback is not None:
-            self.custom_callback(option, self._param_name, values, parser)
 
+class _HelpFormatter(argparse.HelpFormatter):
+    """Formats options with arguments as ``-o ARG, --option=ARG``."""
+
+    def _format_action_invocation(self, action):
+        if action.nargs == 0:
+            return super()._format_action_invocation(action)
+        metavar = action.metavar or action.dest.upper()
+        return ", ".join(
+            "{0!s}{1!s}{2!s}".format(s, "=" if s.startswith("--") else " ", metavar)
+            for s in action.option_strings
+        )
 
-class OptionParser(optparse.OptionParser):
-    """OptionParser that raises exceptions instead of exiting"""
 
-    DEFAULT_VALUE = object()
+class OptionParser(argparse.ArgumentParser):
+    """ArgumentParser that raises exceptions instead of exiting
+
+    :ivar values: Namespace with the values of the options parsed so far,
+        which custom callbacks may inspect or modify.
+    """
+
+    def __init__(self):
+        super().__init__(add_help=False, formatter_class=_HelpFormatter)
 
     def error(self, message):
         raise CommandError(message)
 
+    def parse_known_args(self, args=None, namespace=None):
+        # Parsers are reused (see Command._get_parser), so make sure that
+        # list defaults (from ListOption) are not shared between runs.
+        if namespace is None:
+            namespace = argparse.Namespace()
+            for action in self._actions:
+                if isinstance(action.default, list):
+                    setattr(namespace, action.dest, list(action.default))
+        self.values = namespace
+        return super().parse_known_args(args, namespace)
+
+    def parse_args(self, args=None, namespace=None):
+        """Parse options, allowing them to be mixed with positional arguments.
+
+        :return: (options, args) where options is a namespace with the
+            values of the options given, and args a list of the remaining
+            positional arguments.
+        """
+        if args is None:
+            args = sys.argv[1:]
+        # Everything after "--" is positional, skip it while parsing.
+        try:
+            end = args.index("--")
+        except ValueError:
+            rest = []
+        else:
+            args, rest = args[:end], args[end + 1 :]
+
+        # Like with optparse, an option which takes a value uses the next
+        # argument even if it starts with a dash, which argparse would take
+        # as another option: attach such values to their option instead.
+        takes_value = {
+            s for a in self._actions if a.nargs is None for s in a.option_strings
+        }
+        items = iter(args)
+        args = []
+        for arg in items:
+            if arg in takes_value:
+                value = next(items, None)
+                if value is not None:
+                    if value.startswith("-"):
+                        arg += ("=" if arg.startswith("--") else "") + value
+                    else:
+                        args.append(arg)
+                        arg = value
+            args.append(arg)
+
+        namespace, args = self.parse_known_args(args, namespace)
+        for arg in args:
+            if arg.startswith("-") and arg != "-":
+                self.error("no such option: {0!s}".format(arg))
+        args.extend(rest)
+        return namespace, args
+
+    def format_option_help(self):
+        """Format the help for all the options, without heading nor usage."""
+        formatter = self._get_formatter()
+        formatter.start_section(None)
+        formatter.add_arguments(self._actions)
+        formatter.end_section()
+        return formatter.format_help()
+
 
 def get_optparser(options):
-    """Generate an optparse parser for bzrlib-style options"""
+    """Generate an argparse parser for bzrlib-style options"""
 
     parser = OptionParser()
-    parser.remove_option("--help")
     for option in options.values():
-        option.add_option(parser, option.short_name)
+        option.add_option(parser)
     return parser
 
 
+# Option parsers for each Command subclass, along with the names of the
+# standard options it supports, see Command._get_parser().
+_parser_cache = {}
+
+# Help texts for each (Command subclass, help text, plain, verbose)
+# combination, see Command.get_help_text().
+_help_text_cache = {}
+
+
 def _standard_option(name, **kwargs):
     """Register a standard option."""
     # All standard options are implicitly 'global' ones
-    Option.STD_OPTIONS[name] = Option(name, **kwargs)
-    Option.OPTIONS[name] = Option.STD_OPTIONS[name]
+    _std_options[name] = _options[name] = Option(name, **kwargs)
+    # Standard options are part of every parser and help text.
+    _parser_cache.clear()
+    _help_text_cache.clear()
 
 
 def _global_option(name, **kwargs):
     """Register a global option."""
-    Option.OPTIONS[name] = Option(name, **kwargs)
+    _options[name] = Option(name, **kwargs)
 
 
 # Declare standard options
@@ -292,13 +420,17 @@ _standard_option("help", short_name="h", help="Show help message")
 _standard_option("usage", help="Show usage message and options")
 
 
+_DASH_TO_UNDERSCORE = str.maketrans("-", "_")
+_UNDERSCORE_TO_DASH = str.maketrans("_", "-")
+
+
 def _squish_command_name(name):
     """Gets a valid identifier from a command name.
 
     :param name: Command name.
     :rtype: str
     """
-    return "cmd_" + name.replace("-", "_")
+    return "cmd_" + name.translate(_DASH_TO_UNDERSCORE)
 
 
 def _unsquish_command_name(identifier):
@@ -307,7 +439,7 @@ def _unsquish_command_name(identifier):
     :param identifier: Command identifier.
     :rtype: str
     """
-    return identifier[4:].replace("_", "-")
+    return identifier[4:].translate(_UNDERSCORE_TO_DASH)
 
 
 class Command:
@@ -341,6 +473,11 @@ class Command:
     exceptions = None
     __cmd_param__ = {}
 
+    # Computed for each subclass by __init_subclass__().
+    __cmd_name__ = _unsquish_command_name("Command")
+    __cmd_argform__ = ()
+    __cmd_usage__ = __cmd_name__
+
     def __init__(self, **param):
         assert self.__doc__ != Command.__doc__, "No help message set for {0!r}".format(
             self
@@ -348,22 +485,35 @@ class Command:
         self.supported_std_options = []
         self.param = param
 
+    def __init_subclass__(cls, **kwarg):
+        super().__init_subclass__(**kwarg)
+
+        # Things derived from the class attributes are computed only once:
+        # the command name, the arguments as (name, kind) pairs, where kind
+        # is the suffix character (or empty for plain arguments), and the
+        # usage grammar.
+        cls.__cmd_name__ = _unsquish_command_name(cls.__name__)
+        cls.__cmd_argform__ = tuple(
+            (ap[:-1], ap[-1]) if ap[-1] in "?*+$" else (ap, "") for ap in cls.takes_args
+        )
+        usage = [cls.__cmd_name__]
+        for argname, kind in cls.__cmd_argform__:
+            argname = argname.upper()
+            if kind in ("$", "+"):
+                argname += "..."
+            elif kind == "?":
+                argname = "[" + argname + "]"
+            elif kind == "*":
+                argname = "[" + argname + "...]"
+            usage.append(argname)
+        cls.__cmd_usage__ = " ".join(usage)
+
     def _usage(self):
         """Return a single-line grammar for this action.
 
         Only describes arguments, not options.
         """
-        result = self.name() + " "
-        for aname in self.takes_args:
-            aname = aname.upper()
-            if aname[-1] in ("$", "+"):
-                aname = aname[:-1] + "..."
-            elif aname[-1] == "?":
-                aname = "[" + aname[:-1] + "]"
-            elif aname[-1] == "*":
-                aname = "[" + aname[:-1] + "...]"
-            result += aname + " "
-        return result[:-1]  # Remove last space
+        return self.__cmd_usage__
 
     def prepare(self):
         """Prepare for execution.
@@ -410,20 +560,13 @@ class Command:
 
         return cfgfile
 
-    def name(self):
+    @classmethod
+    def name(cls):
         """Return the name of the action."""
-        if isclass(self):
-            name = self.__name__
-        else:
-            name = self.__class__.__name__
-        return _unsquish_command_name(name)
-
-    name = classmethod(name)
+        return cls.__cmd_name__
 
     def help(self):  # noqa: A003
         """Return help message for this action."""
-        from inspect import getdoc
-
         if self.__doc__ is Command.__doc__:
             return None
         return getdoc(self)
@@ -431,18 +574,37 @@ class Command:
     def options(self):
         """Return dict of valid options for this action.
 
-        Maps from long option name to option object.
+        Maps from long option name to option object. Options from
+        :attr:`takes_options` take precedence over the standard ones.
         """
-        result = Option.STD_OPTIONS.copy()
-        std_names = result.keys()
+        result = dict(Option.STD_OPTIONS)
+        self.supported_std_options = []
         for opt in self.takes_options:
             if isinstance(opt, str):
                 opt = Option.OPTIONS[opt]
-            result[opt.name] = opt
-            if opt.name in std_names:
+            if opt.name in Option.STD_OPTIONS:
                 self.supported_std_options.append(opt.name)
+            result[opt.name] = opt
         return result
 
+    def _get_parser(self):
+        """Return the option parser for this command.
+
+        The parser is built on first use and then shared by all the
+        instances of the same command class.
+
+        :rtype: :class:`OptionParser`
+        """
+        cls = self.__class__
+        cached = _parser_cache.get(cls)
+        if cached is None:
+            parser = get_optparser(self.options())
+            _parser_cache[cls] = parser, tuple(self.supported_std_options)
+        else:
+            parser, supported_std_options = cached
+            self.supported_std_options = list(supported_std_options)
+        return parser
+
     def run_argv_aliases(self, argv, alias_argv=None):
         """Parse the command line and run with extra aliases in alias_argv."""
         assert argv is not None
@@ -457,18 +619,12 @@ class Command:
             sys.stdout.write(self.get_help_text(verbose=False))
             return 0
 
-        # mix arguments and options into one dictionary
-        cmdargs = _match_argform(self.name(), self.takes_args, args)
-        cmdopts = {}
-        for k, v in opts.items():
-            if iskeyword(k):
-                k = "_" + k
-            cmdopts[k.replace("-", "_")] = v
+        # mix arguments and options into one dictionary, options are
+        # already keyed by their (keyword-safe) parameter names
+        cmdargs = _match_argform(self.__cmd_name__, self.__cmd_argform__, args)
+        cmdargs.update(opts)
 
-        all_cmd_args = cmdargs.copy()
-        all_cmd_args.update(cmdopts)
-
-        return self.run_direct(**all_cmd_args)
+        return self.run_direct(**cmdargs)
 
     def run_direct(self, *args, **kwargs):
         """Call run directly with objects (without parsing an argv list)."""
@@ -516,6 +672,14 @@ class Command:
                 "sorry, no detailed help yet for {0!r}".format(self.name())
             )
 
+        # Besides the docstring, which help() may have overridden to be
+        # different e.g. for each tool, the help text depends only on class
+        # attributes, cache it.
+        key = (self.__class__, doc, plain, verbose)
+        text = _help_text_cache.get(key)
+        if text is not None:
+            return text
+
         # Extract the summary (purpose) and sections out from the text
         purpose, sections, order = self._get_help_parts(doc)
 
@@ -525,29 +689,32 @@ class Command:
         else:
             usage = self._usage()
 
+        # For plain text, the headings added here are written directly in
+        # their plain form, and only the text coming from the docstring and
+        # the options needs to be converted. Text which follows a heading in
+        # the same line only needs its :doc: references mapped.
+        if plain:
+            heading = "{0!s}:".format
+            inline, block = _map_doc_refs, rst_to_plain_text
+        else:
+            heading = ":{0!s}:".format
+            inline = block = str
+
         # The header is the purpose and usage
-        result = ""
-        result += ":Purpose: {0!s}\n".format(purpose)
+        result = [heading("Purpose"), " ", inline(purpose), "\n"]
         if usage.find("\n") >= 0:
-            result += ":Usage:\n{0!s}\n".format(usage)
+            result.extend((heading("Usage"), "\n", block(usage + "\n")))
         else:
-            result += ":Usage:   {0!s}\n".format(usage)
-        result += "\n"
+            result.extend((heading("Usage"), "   ", inline(usage), "\n"))
+        result.append("\n")
 
         # Add the options
         #
-        # XXX: optparse implicitly rewraps the help, and not always perfectly,
+        # XXX: argparse implicitly rewraps the help, and not always perfectly,
         # so we get <https://bugs.launchpad.net/bzr/+bug/249908>.  -- mbp
         # 20090319
-        options = get_optparser(self.options()).format_option_help()
-        if options.startswith("Options:"):
-            result += ":" + options
-        elif options.startswith("options:"):
-            # Python 2.4 version of optparse
-            result += ":Options:" + options[len("options:") :]
-        else:
-            result += options
-        result += "\n"
+        options = self._get_parser().format_option_help()
+        result.extend((heading("Options"), "\n", block(options), "\n"))
 
         if verbose:
             # Add the description, indenting it 2 spaces
@@ -555,29 +722,34 @@ class Command:
             if None in sections:
                 text = sections.pop(None)
                 text = "\n  ".join(text.splitlines())
-                result += ":Description:\n  {0!s}\n\n".format(text)
+                result.extend(
+                    (heading("Description"), "\n", block("  " + text + "\n"), "\n")
+                )
 
             # Add the custom sections (e.g. Examples). Note that there's no need
             # to indent these as they must be indented already in the source.
             if sections:
                 for label in order:
                     if label in sections:
-                        result += ":{0!s}:\n{1!s}\n".format(label, sections[label])
-                result += "\n"
+                        result.extend(
+                            (heading(label), "\n", block(sections[label] + "\n"))
+                        )
+                result.append("\n")
         else:
-            result += 'See "help {0!s}" for more details and examples.\n\n'.format(
-                self.name()
+            result.append(
+                'See "help {0!s}" for more details and examples.\n\n'.format(
+                    self.name()
+                )
             )
 
         # Add the aliases, source (plug-in) and see also links, if any
         if self.aliases:
-            result += ":Aliases: "
-            result += ", ".join(self.aliases) + "\n"
+            result.extend(
+                (heading("Aliases"), " ", inline(", ".join(self.aliases)), "\n")
+            )
 
-        # If this will be rendered as plain text, convert it
-        if plain:
-            result = rst_to_plain_text(result)
-        return result
+        text = _help_text_cache[key] = "".join(result)
+        return text
 
     def _get_help_parts(text):
         """Split help text into a summary and named sections.
@@ -591,10 +763,11 @@ class Command:
             default section which is given the key of None.
         """
 
+        # Sections are kept as lists of lines, and joined only at the end.
         def save_section(sections, order, label, section):
-            if len(section) > 0:
+            if section:
                 if label in sections:
-                    sections[label] += "\n" + section
+                    sections[label].extend(section)
                 else:
                     order.append(label)
                     sections[label] = section
@@ -603,20 +776,20 @@ class Command:
         summary = lines.pop(0) if lines else ""
         sections = {}
         order = []
-        label, section = None, ""
+        label, section = None, []
         for line in lines:
-            if line.startswith(":") and line.endswith(":") and len(line) > 2:
+            heading = _SECTION_HEADING_RE.match(line)
+            if heading:
                 save_section(sections, order, label, section)
-                label, section = line[1:-1], ""
+                label, section = heading.group(1), []
             elif (label is not None) and len(line) > 1 and not line[0].isspace():
                 save_section(sections, order, label, section)
-                label, section = None, line
-            else:
-                if len(section) > 0:
-                    section += "\n" + line
-                else:
-                    section = line
+                label, section = None, [line]
+            elif section or line:
+                # Leading empty lines are skipped.
+                section.append(line)
         save_section(sections, order, label, section)
+        sections = {k: "\n".join(v) for k, v in sections.items()}
         return summary, sections, order
 
     _get_help_parts = staticmethod(_get_help_parts)
@@ -631,52 +804,50 @@ def parse_args(cmd, argv, alias_argv=None):
     they take, and which commands will accept them.
     """
     # TODO: make it a method of the command?
-    parser = get_optparser(cmd.options())
+    parser = cmd._get_parser()
     if alias_argv is not None:
         args = alias_argv + argv
     else:
         args = argv
 
     options, args = parser.parse_args(args)
-    opts = {
-        k: v for k, v in options.__dict__.items() if v is not OptionParser.DEFAULT_VALUE
-    }
-    return args, opts
+    return args, vars(options)
 
 
-def _match_argform(cmd, takes_args, args):
+def _match_argform(cmd, argform, args):
+    # Note that the list of arguments is consumed, and may end up being
+    # used as value for "*", "+", and "$" arguments without copying it.
     argdict = {}
 
-    # step through args and takes_args, allowing appropriate 0-many matches
-    for ap in takes_args:
-        argname = ap[:-1]
-        if ap[-1] == "?":
+    # step through args and argform, allowing appropriate 0-many matches
+    for argname, kind in argform:
+        if kind == "?":
             if args:
                 argdict[argname] = args.pop(0)
-        elif ap[-1] == "*":  # all remaining arguments
+        elif kind == "*":  # all remaining arguments
             if args:
-                argdict[argname + "_list"] = args[:]
+                argdict[argname + "_list"] = args
                 args = []
             else:
                 argdict[argname + "_list"] = ()
-        elif ap[-1] == "+":
+        elif kind == "+":
             if not args:
                 raise CommandError(
                     "command {0!r} needs one or more {1!s}".format(cmd, argname.upper())
                 )
             else:
-                argdict[argname + "_list"] = args[:]
+                argdict[argname + "_list"] = args
                 args = []
-        elif ap[-1] == "$":  # all but one
+        elif kind == "$":  # all but one
             if len(args) < 2:
                 raise CommandError(
                     "command {0!r} needs one or more {1!s}".format(cmd, argname.upper())
                 )
-            argdict[argname + "_list"] = args[:-1]
-            args[:-1] = []
+            last = args.pop()
+            argdict[argname + "_list"] = args
+            args = [last]
         else:
             # just a plain arg
-            argname = ap
             if not args:
                 raise CommandError(
                     "command {0!r} requires argument {1!s}".format(cmd, argname.upper())
@@ -699,8 +870,6 @@ def ignore_pipe_err(func):
     """
 
     def ignore_pipe(*args, **kwargs):
-        import errno
-
         try:
             result = func(*args, **kwargs)
             sys.stdout.flush()
@@ -722,8 +891,8 @@ def ignore_pipe_err(func):
 class cmd_help(Command):
     """Show help on a command."""
 
-    takes_args = ["topic?"]
-    aliases = ["?", "--help", "-?", "-h"]
+    takes_args = ("topic?",)
+    aliases = ("?", "--help", "-?", "-h")
 
     def run(self, topic=None, long=False):
         if topic is None:
@@ -753,6 +922,12 @@ class CLI:
 
     :ivar _registry: Dictionary containing all registered commands, mapping
         names to :class:`Command` instances.
+    :ivar _by_name_or_alias: Dictionary mapping both names and aliases to
+        :class:`Command` instances, rebuilt whenever commands are added.
+    :ivar _instances: Dictionary mapping :class:`Command` subclasses to
+        their instances, which are created on demand.
+    :ivar _finalized: Whether :meth:`finalize` has been called, after which
+        no more commands can be registered.
     """
 
     def scan_commands(module, klass=None, **param):
@@ -847,6 +1022,9 @@ class CLI:
         """
         self.name = name or sys.argv[0]
         self._registry = {}
+        self._by_name_or_alias = {}
+        self._instances = {}
+        self._finalized = False
 
         param["cmd:help_output"] = self._output_help
         param["cmd:tool_name"] = self.name
@@ -856,6 +1034,8 @@ class CLI:
         if isinstance(config_file, str) and config_file:
             param["cmd:config_file"] = config_file
 
+        if commands is None:
+            commands = sys._getframe(1).f_globals
         self.add_commands(commands, **param)
 
         # Add our built-in commands ("help" for now)
@@ -872,20 +1052,58 @@ class CLI:
         :param commands: List of modules (or strings with module names) from
             which commands will be used. As an option, you may directly pass
             a dictionary mapping names to instances of :class:`Command`. If
-            not give, the module from which the class is being instantiated
-            will be used.
+            not given, the module from which the method is called will be
+            used.
+        :raise RuntimeError: If :meth:`finalize` was already called.
         """
+        if self._finalized:
+            raise RuntimeError("Cannot add commands to a finalized CLI")
+
         kw["cmd:help_output"] = self._output_help
 
         if commands is None:
-            commands = [sys._getframe(2).f_globals]
+            commands = sys._getframe(1).f_globals
         elif isinstance(commands, (list, tuple)):
             commands = {c.name(): c for c in commands}
         if isinstance(commands, (dict, str, types.ModuleType)):
             commands = [commands]
 
+        scanned = {}
         for item in commands:
-            self._registry.update(self.scan_commands(item, *arg, **kw))
+            scanned.update(self.scan_commands(item, *arg, **kw))
+        registry = dict(self._registry)
+        registry.update(scanned)
+
+        # Names always take precedence over aliases, but an alias cannot be
+        # declared by different commands: which one gets picked would depend
+        # on the order in which they were registered. Aliases inherited from
+        # a parent class are only used when no other command declares them.
+        by_name_or_alias = {}
+        inherited = []
+        for command in registry.values():
+            if "aliases" not in command.__dict__:
+                inherited.append(command)
+                continue
+            for alias in command.aliases:
+                other = by_name_or_alias.setdefault(alias, command)
+                if other is not command:
+                    raise ValueError(
+                        "alias {0!r} of command {1!r} already used by {2!r}".format(
+                            alias, command.name(), other.name()
+                        )
+                    )
+        for command in inherited:
+            for alias in command.aliases:
+                by_name_or_alias.setdefault(alias, command)
+        by_name_or_alias.update(registry)
+
+        self._registry = registry
+        self._by_name_or_alias = by_name_or_alias
+
+        # Scanning updates __cmd_param__, so instances created before with
+        # the old parameters must not be reused.
+        for command in scanned.values():
+            self._instances.pop(command, None)
 
     def _output_help_commands(self, hidden=False, indent=0):
         """Generate text output for 'help commands'
@@ -893,27 +1111,29 @@ class CLI:
         :param hidden: Whether to include hidden commands in the output.
         :param indent: Indent each line with the given amount of spaces.
         """
-        cmdnames = [n for n, c in self._registry.items() if c.hidden == hidden]
+        # It is better to have the output sorted by name.
+        commands = sorted(
+            ((n, c) for n, c in self._registry.items() if c.hidden == hidden),
+            key=lambda item: item[0],
+        )
 
-        if not cmdnames:
+        if not commands:
             return ""
 
-        max_name = max((len(n) for n in cmdnames))
+        max_name = max(len(n) for n, _ in commands)
         result = []
 
-        # It is better to have the output sorted by name.
-        cmdnames.sort()
-
         if indent:
             indent = " " * indent
         else:
             indent = ""
 
-        for name in cmdnames:
-            cmd = self.get_command(name)
-            helptext = cmd.help()
-            if helptext:
-                firstline = helptext.split("\n", 1)[0]
+        for name, command in commands:
+            # Only the first line is needed, so avoid instantiating the
+            # command and cleaning up its whole docstring with help().
+            helptext = command.__doc__
+            if helptext and helptext is not Command.__doc__:
+                firstline = helptext.lstrip().split("\n", 1)[0]
             else:
                 firstline = ""
 
@@ -923,6 +1143,22 @@ class CLI:
 
         return "".join(result)
 
+    def finalize(self):
+        """Freeze the command registry.
+
+        Once called, the registered commands cannot be changed anymore and
+        :meth:`add_commands` will raise :class:`RuntimeError`. This is done
+        automatically by :meth:`run`, but may be called earlier.
+
+        :raise RuntimeError: If no commands have been registered.
+        """
+        if not self._finalized:
+            if not self._registry:
+                raise RuntimeError("CLI has no commands registered")
+            self._registry = types.MappingProxyType(self._registry)
+            self._by_name_or_alias = types.MappingProxyType(self._by_name_or_alias)
+            self._finalized = True
+
     def _output_help(self, topic):
         """Print out help for a given topic.
 
@@ -937,10 +1173,14 @@ class CLI:
             text = self._output_help_commands()
         elif topic == "hidden-commands":
             text = self._output_help_commands(hidden=True)
-        elif self.has_command(topic):
-            text = self.get_command(topic).get_help_text()
         else:
-            text = "{0!s}: Unavailable help topic '{1!s}'\n".format(self.name, topic)
+            command = self._lookup(topic)
+            if command is None:
+                text = "{0!s}: Unavailable help topic '{1!s}'\n".format(
+                    self.name, topic
+                )
+            else:
+                text = command.get_help_text()
 
         sys.stdout.write(text)
 
@@ -951,17 +1191,25 @@ class CLI:
         :param alias: Allow searching for aliases.
         :rtype: :class:`Command`
         """
-        assert self._registry
+        command = self._lookup(name, alias)
+        if command is None:
+            raise KeyError("No such command {0!r}".format(name))
+        return command
 
-        command = self._registry.get(name)
-        if command:
-            return command(**command.__cmd_param__)
-        elif alias:
-            for command in self._registry.values():
-                if name in command.aliases:
-                    return command(**command.__cmd_param__)
+    def _lookup(self, name, alias=True):
+        """Obtain a command given its name, without raising on failure.
 
-        raise KeyError("No such command {0!r}".format(name))
+        :param name: Name of the command.
+        :param alias: Allow searching for aliases.
+        :return: A :class:`Command` instance, or ``None``.
+        """
+        command = (self._by_name_or_alias if alias else self._registry).get(name)
+        if command is None:
+            return None
+        instance = self._instances.get(command)
+        if instance is None:
+            instance = self._instances[command] = command(**command.__cmd_param__)
+        return instance
 
     def has_command(self, name, alias=True):
         """Check whether a command exists given its name.
@@ -970,14 +1218,7 @@ class CLI:
         :param alias: Allow searching for aliases.
         :rtype: bool
         """
-        assert self._registry
-
-        if alias:
-            for command in self._registry.values():
-                if name in command.aliases:
-                    return True
-
-        return name in self._registry
+        return name in (self._by_name_or_alias if alias else self._registry)
 
     def run(self, argv=None):
         """Run the command line tool.
@@ -986,17 +1227,24 @@ class CLI:
             as command name. If not given, then ``sys.argv[1:]`` will be
             used.
         """
-        if argv is None:
-            argv = [
-                item.decode("utf-8") if isinstance(item, bytes) else item
-                for item in sys.argv[1:]
-            ]
+        self.finalize()
 
-        try:
-            cmd = argv and argv.pop(0) or "help"
-            cmd = self.get_command(cmd)
-        except KeyError:
-            return "{0!s}: command '{1!s}' does not exist.".format(self.name, cmd)
+        if argv is None:
+            argv = sys.argv[1:]
+            # On Python 3 the arguments are already decoded, so normally
+            # there is nothing to convert.
+            if any(isinstance(item, bytes) for item in argv):
+                argv = [
+                    item.decode("utf-8") if isinstance(item, bytes) else item
+                    for item in argv
+                ]
+
+        # Slice instead of popping, the caller's list is left untouched.
+        name = argv[0] if argv else "help"
+        argv = argv[1:]
+        cmd = self._lookup(name)
+        if cmd is None:
+            return "{0!s}: command '{1!s}' does not exist.".format(self.name, name)
 
         try:
             return cmd.run_argv_aliases(argv) or 0
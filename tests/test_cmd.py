@@ -10,8 +10,6 @@
 Test suite for the cmdcmd.cmd module.
 """
 
-from inspect import isclass
-
 from pytest import raises
 
 from cmdcmd import cmd
@@ -41,11 +39,20 @@ class cmd_spam(cmd.Command):
 
 
 class TestCmdCommand:
+    @classmethod
+    def setup_class(cls):
+        # Tests which do not modify the CLI share instances, built once.
+        cls._clis = {
+            commands: cmd.CLI("foobar", commands=commands)
+            for commands in ((cmd_foo, cmd_bar), (cmd_foo, cmd_bar, cmd_spam))
+        }
+
     def assertIsCommand(self, command, cmdclass=None):
-        assert not isclass(command)
-        assert isinstance(command, cmd.Command)
-        if cmdclass is not None:
-            assert isinstance(command, cmdclass)
+        assert not isinstance(command, type)
+        if cmdclass is None:
+            assert isinstance(command, cmd.Command)
+        else:
+            assert type(command) is cmdclass
 
     def test_get_unexistant_cmd(self):
         cli = cmd.CLI("foobar", commands=(cmd_foo, cmd_bar))
@@ -61,14 +68,117 @@ class TestCmdCommand:
             cli.get_command("baz", False)
 
     def test_get_cmd(self):
-        cli = cmd.CLI("foobar", commands=(cmd_foo, cmd_bar))
+        cli = self._clis[cmd_foo, cmd_bar]
         self.assertIsCommand(cli.get_command("foo", True), cmd_foo)
         self.assertIsCommand(cli.get_command("foo", False), cmd_foo)
 
     def test_get_cmd_alias(self):
-        cli = cmd.CLI("foobar", commands=(cmd_foo, cmd_bar, cmd_spam))
+        cli = self._clis[cmd_foo, cmd_bar, cmd_spam]
         self.assertIsCommand(cli.get_command("eggs", True), cmd_spam)
         self.assertIsCommand(cli.get_command("spam", True), cmd_spam)
         self.assertIsCommand(cli.get_command("spam", False), cmd_spam)
         with raises(KeyError):
             cli.get_command("eggs", False)
+
+    def test_get_cmd_memoized(self):
+        cli = self._clis[cmd_foo, cmd_bar, cmd_spam]
+        command = cli.get_command("foo")
+        assert cli.get_command("foo") is command
+        assert cli.get_command("foo", False) is command
+        assert cli.get_command("eggs") is cli.get_command("spam")
+
+    def test_get_cmd_reregistered(self):
+        cli = cmd.CLI("foobar", commands=(cmd_foo,))
+        command = cli.get_command("foo")
+        cli.add_command(cmd_foo)
+        assert cli.get_command("foo") is not command
+
+    def test_finalize(self):
+        cli = cmd.CLI("foobar", commands=(cmd_foo,))
+        assert cli.run(["help"]) == 0
+        with raises(RuntimeError):
+            cli.add_command(cmd_bar)
+        assert not cli.has_command("bar")
+        self.assertIsCommand(cli.get_command("foo"), cmd_foo)
+
+    def test_alias_collision(self):
+        class cmd_ham(cmd.Command):
+            """Does ham, has the same alias as spam."""
+
+            aliases = ("eggs",)
+
+        cli = cmd.CLI("foobar", commands=(cmd_spam,))
+        with raises(ValueError):
+            cli.add_command(cmd_ham)
+        # The CLI is left untouched.
+        assert not cli.has_command("ham")
+        self.assertIsCommand(cli.get_command("eggs"), cmd_spam)
+
+    def test_alias_inherited(self):
+        class cmd_spam_too(cmd_spam):
+            """Does spam too, inheriting its aliases."""
+
+        cli = cmd.CLI("foobar", commands=(cmd_spam_too, cmd_spam))
+        self.assertIsCommand(cli.get_command("eggs"), cmd_spam)
+        self.assertIsCommand(cli.get_command("spam-too"), cmd_spam_too)
+
+
+def test_commands_from_caller_module():
+    cli = cmd.CLI("foobar")
+    assert cli.has_command("foo")
+    assert cli.has_command("eggs")
+    cli = cmd.CLI("foobar", commands=())
+    assert not cli.has_command("foo")
+    cli.add_commands()
+    assert cli.has_command("foo")
+
+
+def test_command_private_attributes():
+    class cmd_custom_name(cmd.Command):
+        """Has attributes of its own."""
+
+        _name = "custom"
+        _argform = "whatever"
+
+        def run(self):
+            return self._name
+
+    assert isinstance(cmd.Command.name(), str)
+    assert cmd_custom_name.name() == "custom-name"
+    assert cmd_custom_name._name == "custom"
+    assert cmd_custom_name._argform == "whatever"
+    assert cmd_custom_name().run_argv_aliases([]) == "custom"
+
+
+def test_help_text_override(capsys):
+    class cmd_dyn(cmd.Command):
+        """Placeholder."""
+
+        def help(self):  # noqa: A003
+            return "Dynamic {0!s}".format(self.param["cmd:tool_name"])
+
+    for tool in ("toolA", "toolB"):
+        cli = cmd.CLI(tool, commands=(cmd_dyn,))
+        assert cli.run(["help", "dyn"]) == 0
+        assert "Dynamic " + tool in capsys.readouterr().out
+
+
+def test_get_help_parts():
+    text = """Summary line.
+
+    Description text.
+
+    :Examples:
+        foo bar
+
+    More description.
+    """
+    from inspect import cleandoc
+
+    summary, sections, order = cmd.Command._get_help_parts(cleandoc(text))
+    assert summary == "Summary line."
+    assert order == [None, "Examples"]
+    assert sections == {
+        None: "Description text.\n\nMore description.",
+        "Examples": "    foo bar\n",
+    }
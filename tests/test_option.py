@@ -8,6 +8,8 @@
 
 from enum import Enum
 
+from pytest import raises
+
 from cmdcmd import cmd
 
 
@@ -41,3 +43,214 @@ def test_enum_option_invalid_value():
     assert "invalid choice" in cli.run(["foo", "-p", "bananas"])
     assert "invalid choice" in cli.run(["foo", "--protocol=bananas"])
     assert "invalid choice" in cli.run(["foo", "--protocol", "bananas"])
+
+
+def test_option_switches():
+    option = cmd_foo.takes_options[0]
+    assert option.short_name == "p"
+    assert option.negation_name == "no-protocol"
+    assert list(option.iter_switches()) == [("protocol", "p", "PROTOCOL", "Protocol")]
+
+
+class cmd_resume(cmd.Command):
+    """Resumes something."""
+
+    takes_options = (cmd.Option("continue", help="Continue"),)
+
+    def run(self, _continue=False):
+        return _continue
+
+
+def test_keyword_option():
+    cli = cmd.CLI("foobar", commands=(cmd_resume,))
+    assert cli.run(["resume"]) == 0
+    assert cli.run(["resume", "--continue"]) is True
+    assert cli.run(["resume", "--no-continue"]) == 0
+
+
+class cmd_build(cmd.Command):
+    """Builds something."""
+
+    takes_options = (cmd.Option("class", type=str, param_name="klass-name"),)
+
+    def run(self, klass_name=None):
+        return klass_name
+
+
+def test_param_name_option():
+    cli = cmd.CLI("foobar", commands=(cmd_build,))
+    assert cli.run(["build", "--class=thing"]) == "thing"
+
+
+def test_run_keeps_argv():
+    cli = cmd.CLI("foobar", commands=(cmd_resume,))
+    argv = ["resume", "--continue"]
+    assert cli.run(argv) is True
+    assert argv == ["resume", "--continue"]
+
+
+class cmd_items(cmd.Command):
+    """Collects items."""
+
+    takes_options = (cmd.ListOption("item", short_name="i", type=int, help="Item"),)
+
+    def run(self, item):
+        return item
+
+
+def test_list_option():
+    cli = cmd.CLI("foobar", commands=(cmd_items,))
+    assert cli.run(["items", "-i", "1", "--item=2"]) == [1, 2]
+    assert cli.run(["items", "-i", "1", "-i", "-", "-i", "3"]) == [3]
+    # Values from previous runs must not be kept.
+    assert cli.run(["items"]) == 0
+    assert "invalid value" in cli.run(["items", "-i", "foo"])
+
+
+def test_options_order():
+    command = cmd_items()
+    assert list(command.options()) == ["help", "usage", "item"]
+    assert command.supported_std_options == []
+
+
+class cmd_parent(cmd.Command):
+    """Handles help by itself."""
+
+    takes_options = ("help",)
+
+    def run(self, help=False):  # noqa: A002
+        return help
+
+
+def test_supported_std_options():
+    for _ in range(2):
+        command = cmd_parent()
+        assert command.run_argv_aliases([]) is False
+        assert command.supported_std_options == ["help"]
+
+
+calls = []
+
+
+def record_call(option, name, value, parser):
+    calls.append((name, value, vars(parser.values).copy()))
+
+
+class cmd_count(cmd.Command):
+    """Counts things."""
+
+    takes_args = ("things*",)
+    takes_options = (
+        cmd.Option(
+            "verbose",
+            short_name="v",
+            help="Be verbose",
+            custom_callback=record_call,
+        ),
+        cmd.Option(
+            "max-count",
+            type=int,
+            help="Maximum",
+            custom_callback=record_call,
+        ),
+        cmd.Option("debug", help="Debug", hidden=True),
+    )
+
+    def run(self, things_list=(), verbose=False, max_count=None, debug=False):
+        return list(things_list), verbose, max_count, debug
+
+
+def test_custom_callback():
+    cli = cmd.CLI("foobar", commands=(cmd_count,))
+    del calls[:]
+    assert cli.run(["count", "-v", "--max-count=3"]) == ([], True, 3, False)
+    assert calls == [
+        ("verbose", True, {"verbose": True}),
+        ("max-count", 3, {"verbose": True, "max_count": 3}),
+    ]
+    del calls[:]
+    assert cli.run(["count", "--no-verbose"]) == ([], False, None, False)
+    assert calls == [("verbose", False, {"verbose": False})]
+
+
+def test_double_dash():
+    cli = cmd.CLI("foobar", commands=(cmd_count,))
+    assert cli.run(["count", "a", "--debug", "--", "-v", "--max-count=1"]) == (
+        ["a", "-v", "--max-count=1"],
+        False,
+        None,
+        True,
+    )
+    assert "no such option" in cli.run(["count", "--bananas", "--", "a"])
+
+
+def test_hidden_option():
+    text = cmd_count().get_help_text(plain=True)
+    assert "--verbose" in text
+    assert "--debug" not in text
+    cli = cmd.CLI("foobar", commands=(cmd_count,))
+    assert cli.run(["count", "--debug"]) == ([], False, None, True)
+
+
+def test_global_option():
+    cmd._global_option("test-global", help="Global")
+    try:
+        assert "test-global" in cmd.Option.OPTIONS
+        assert "test-global" not in cmd.Option.STD_OPTIONS
+        with raises(TypeError):
+            cmd.Option.OPTIONS["other"] = None
+
+        class cmd_global(cmd.Command):
+            takes_options = ("test-global",)
+
+            def run(self, test_global=False):
+                return test_global
+
+        cli = cmd.CLI("foobar", commands=(cmd_global,))
+        assert cli.run(["global", "--test-global"]) is True
+    finally:
+        del cmd._options["test-global"]
+
+
+class cmd_quiet(cmd.Command):
+    """Options without help."""
+
+    takes_options = (
+        cmd.Option("quiet", help=None),
+        cmd.ListOption("tag", type=str, help=None),
+    )
+
+    def run(self, quiet=False, tag=()):
+        return quiet, tag
+
+
+def test_option_without_help():
+    cli = cmd.CLI("foobar", commands=(cmd_quiet,))
+    assert cli.run(["quiet", "--quiet", "--tag=a"]) == (True, ["a"])
+    text = cmd_quiet().get_help_text(plain=True)
+    assert "--quiet" in text
+    assert "--tag=ARG" in text
+
+
+class cmd_msg(cmd.Command):
+    """Takes a message."""
+
+    takes_args = ("file?",)
+    takes_options = (
+        cmd.Option("message", short_name="m", type=str, help="Message"),
+        cmd.Option("verbose", help="Be verbose"),
+    )
+
+    def run(self, file=None, message=None, verbose=False):
+        return file, message, verbose
+
+
+def test_option_value_with_dash():
+    cli = cmd.CLI("foobar", commands=(cmd_msg, cmd_quiet))
+    assert cli.run(["msg", "-m", "-foo"]) == (None, "-foo", False)
+    assert cli.run(["msg", "--message", "--verbose", "x"]) == ("x", "--verbose", False)
+    assert cli.run(["msg", "--message=-foo", "--verbose"]) == (None, "-foo", True)
+    assert cli.run(["msg", "-m", "foo", "-"]) == ("-", "foo", False)
+    assert cli.run(["quiet", "--tag", "--quiet", "--tag=-"]) == (False, [])
+    assert cli.run(["quiet", "--tag", "--quiet"]) == (False, ["--quiet"])
+    assert "expected one argument" in cli.run(["msg", "--message"])